@@ -8,5 +8,5 @@ class BaseAgent(ABC):
         self.config = config  
   
     @abstractmethod  
-    async def execute(self, task: Dict[str, Any]) -, Any]:  
+    async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:  
         pass 
@@ -1,11 +1,89 @@
 # Geolocation Reasoning Agent for TuXun Agent
 # Updated to work with Silicon Flow API
-import requests
+import httpx
+import diskcache
+from blake3 import blake3
 from .base_agent import BaseAgent
-from typing import Dict, Any
-import json
+from typing import Dict, Any, Optional
+import asyncio
+import copy
+import functools
+import orjson
+import os
 import re
 
+# Matches a JSON object wrapped in a markdown code fence
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*({.*?})\s*```', re.DOTALL)
+
+_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are an expert at determining geographic locations from image features and contextual information. Provide the most likely location with coordinates, accuracy estimate, and confidence score. Respond in JSON format."
+}
+
+# Static skeleton of the analysis prompt; only the image features and user context vary
+_PROMPT_FEATURE_KEYS = ('size', 'mode', 'brightness', 'edges', 'dominant_colors')
+_ANALYSIS_PROMPT = """
+        Analyze the following image features to determine the geographic location:
+        
+        Image Features:
+        - Size: {size}
+        - Mode: {mode}
+        - Brightness: {brightness}
+        - Number of edges: {edges}
+        - Dominant colors: {dominant_colors}
+        
+        User Context: {user_context}
+        
+        Based on these features, please provide:
+        1. Most likely geographic location (city, region, country)
+        2. Estimated latitude and longitude coordinates
+        3. Accuracy level (high, medium, low)
+        4. Confidence score (0-1)
+        5. Alternative possible locations with lower confidence
+        6. Reasoning for your prediction
+        
+        Respond in JSON format with the following structure:
+        {{
+            "predicted_location": {{
+                "latitude": <number>,
+                "longitude": <number>,
+                "accuracy": "<high|medium|low>",
+                "confidence": <number>
+            }},
+            "reasoning": "<explanation>",
+            "alternative_locations": [
+                {{
+                    "latitude": <number>,
+                    "longitude": <number>,
+                    "confidence": <number>
+                }}
+            ]
+        }}
+        """
+
+# Shared HTTP/2 client, created on first use so it binds to the running event loop
+_ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
+
+def get_async_client(max_retries: int = 3) -> httpx.AsyncClient:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+        transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=max_retries)
+        _ASYNC_CLIENT = httpx.AsyncClient(transport=transport)
+    return _ASYNC_CLIENT
+
+@functools.lru_cache(maxsize=1024)
+def _cache_key(canonical: bytes) -> str:
+    # Stable digest of the canonicalized (image_features, user_context) pair
+    return blake3(canonical).hexdigest()
+
+async def close_async_client():
+    # Release pooled connections held by the shared client
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
+
 class GeolocationReasoningAgent(BaseAgent):
     def __init__(self, name: str, config: Dict[str, Any]):
         super().__init__(name, config)
@@ -13,6 +91,23 @@ class GeolocationReasoningAgent(BaseAgent):
         self.base_url = config.get('SILICON_FLOW_BASE_URL', 'https://api.siliconflow.com/v1')
         self.default_model = config.get('DEFAULT_MODEL', 'qwen2.5-72b-instruct')
         self.temperature = float(config.get('MODEL_TEMPERATURE', '0.3'))
+        self.timeout = int(config.get('TIMEOUT', 30))
+        self.max_retries = int(config.get('MAX_RETRIES', 3))
+        self._headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        self._prompt_tpl = _ANALYSIS_PROMPT.format
+
+        # Persistent cache of parsed LLM responses, shared across restarts
+        cache_dir = os.path.join(config.get('DATA_FOLDER', './data'), 'llm_cache')
+        self._cache = diskcache.Cache(cache_dir)
+        self.cache_ttl = int(config.get('LLM_CACHE_TTL', 86400))
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # Cache key -> in-flight API call, so concurrent identical requests share one call
+        self._inflight: Dict[str, asyncio.Task] = {}
 
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         # Get image analysis results from task
@@ -42,23 +137,38 @@ class GeolocationReasoningAgent(BaseAgent):
         return location_prediction
     
     async def analyze_visual_context(self, image_features: Dict[str, Any], user_context: str) -> Dict[str, Any]:
+        # Skip the LLM round-trip entirely for features we have already analyzed
+        canonical = orjson.dumps(
+            {'image_features': image_features, 'user_context': user_context},
+            option=orjson.OPT_SORT_KEYS, default=str
+        )
+        key = _cache_key(canonical)
+        cached = self._cache.get(key)
+        self._record_cache_lookup(cached is not None)
+        if cached is not None:
+            return cached
+
+        # Coalesce concurrent requests for the same features into a single API call;
+        # shield it so one caller disconnecting doesn't cancel it for the others
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request_prediction(key, image_features, user_context))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+    
+    async def _request_prediction(self, key: str, image_features: Dict[str, Any],
+                                  user_context: str) -> Dict[str, Any]:
         # Prepare a prompt for the LLM to analyze visual features and context
         prompt = self.create_analysis_prompt(image_features, user_context)
         
         # Use Silicon Flow API to analyze the image features and context
         try:
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-            
             payload = {
                 'model': self.default_model,
                 'messages': [
-                    {
-                        "role": "system", 
-                        "content": "You are an expert at determining geographic locations from image features and contextual information. Provide the most likely location with coordinates, accuracy estimate, and confidence score. Respond in JSON format."
-                    },
+                    _SYSTEM_MESSAGE,
                     {
                         "role": "user",
                         "content": prompt
@@ -69,18 +179,22 @@ class GeolocationReasoningAgent(BaseAgent):
                 'response_format': {"type": "json_object"}
             }
             
-            response = requests.post(
+            client = get_async_client(self.max_retries)
+            response = await client.post(
                 f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload
+                headers=self._headers,
+                content=orjson.dumps(payload),
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 content = result['choices'][0]['message']['content']
                 
                 # Parse the response
                 parsed_result = self.parse_llm_response(content)
+                if parsed_result != self.get_fallback_prediction():
+                    self._cache.set(key, parsed_result, expire=self.cache_ttl)
                 return parsed_result
             else:
                 print(f"Error from Silicon Flow API: {response.status_code} - {response.text}")
@@ -90,64 +204,36 @@ class GeolocationReasoningAgent(BaseAgent):
             print(f"Error in Silicon Flow API geolocation reasoning: {e}")
             return self.get_fallback_prediction()
     
+    def _record_cache_lookup(self, hit: bool):
+        if hit:
+            self._cache_hits += 1
+        else:
+            self._cache_misses += 1
+        lookups = self._cache_hits + self._cache_misses
+        if lookups % 100 == 0:
+            print(f"LLM cache: {self._cache_hits}/{lookups} hits ({self._cache_hits / lookups:.1%})")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            'hits': self._cache_hits,
+            'misses': self._cache_misses,
+            'hit_ratio': self._cache_hits / lookups if lookups else 0.0
+        }
+    
     def create_analysis_prompt(self, image_features: Dict[str, Any], user_context: str) -> str:
-        prompt = f"""
-        Analyze the following image features to determine the geographic location:
-        
-        Image Features:
-        - Size: {image_features.get('size', 'Unknown')}
-        - Mode: {image_features.get('mode', 'Unknown')}
-        - Brightness: {image_features.get('brightness', 'Unknown')}
-        - Number of edges: {image_features.get('edges', 'Unknown')}
-        - Dominant colors: {image_features.get('dominant_colors', 'Unknown')}
-        
-        User Context: {user_context if user_context else 'No additional context provided'}
-        
-        Based on these features, please provide:
-        1. Most likely geographic location (city, region, country)
-        2. Estimated latitude and longitude coordinates
-        3. Accuracy level (high, medium, low)
-        4. Confidence score (0-1)
-        5. Alternative possible locations with lower confidence
-        6. Reasoning for your prediction
-        
-        Respond in JSON format with the following structure:
-        {{
-            "predicted_location": {{
-                "latitude": <number>,
-                "longitude": <number>,
-                "accuracy": "<high|medium|low>",
-                "confidence": <number>
-            }},
-            "reasoning": "<explanation>",
-            "alternative_locations": [
-                {{
-                    "latitude": <number>,
-                    "longitude": <number>,
-                    "confidence": <number>
-                }}
-            ]
-        }}
-        """
-        return prompt
+        return self._prompt_tpl(
+            **{k: image_features.get(k, 'Unknown') for k in _PROMPT_FEATURE_KEYS},
+            user_context=user_context or 'No additional context provided'
+        )
     
     def parse_llm_response(self, response: str) -> Dict[str, Any]:
         try:
-            # Extract JSON from response if it's wrapped in markdown
-            json_match = re.search(r'```(?:json)?\s*({.*?})\s*```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to find JSON object directly
-                json_start = response.find('{')
-                json_end = response.rfind('}') + 1
-                if json_start != -1 and json_end != 0:
-                    json_str = response[json_start:json_end]
-                else:
-                    json_str = response.strip()
-            
-            # Parse the JSON response
-            result = json.loads(json_str)
+            try:
+                # With response_format=json_object the reply is normally bare JSON
+                result = orjson.loads(response)
+            except orjson.JSONDecodeError:
+                result = orjson.loads(self._extract_json(response))
             
             # Validate the structure
             if 'predicted_location' not in result:
@@ -170,6 +256,19 @@ class GeolocationReasoningAgent(BaseAgent):
             print(f"Response content: {response}")
             return self.get_fallback_prediction()
     
+    def _extract_json(self, response: str) -> str:
+        # Extract JSON from response if it's wrapped in markdown
+        json_match = _JSON_FENCE_RE.search(response)
+        if json_match:
+            return json_match.group(1)
+        
+        # Try to find JSON object directly
+        json_start = response.find('{')
+        json_end = response.rfind('}') + 1
+        if json_start != -1 and json_end != 0:
+            return response[json_start:json_end]
+        return response.strip()
+    
     def get_fallback_prediction(self) -> Dict[str, Any]:
         # Return a fallback prediction when analysis fails
         return {
@@ -15,9 +15,10 @@ router = APIRouter()
 
 # Initialize agents and modules
 config = Config()
-image_agent = ImageProcessingAgent("ImageProcessingAgent", config.__dict__)
-reasoning_agent = GeolocationReasoningAgent("GeolocationReasoningAgent", config.__dict__)
-validation_module = ValidationModule(config.__dict__)
+settings = config.as_dict()
+image_agent = ImageProcessingAgent("ImageProcessingAgent", settings)
+reasoning_agent = GeolocationReasoningAgent("GeolocationReasoningAgent", settings)
+validation_module = ValidationModule(settings)
 
 @router.post("/geolocate")
 async def geolocate_image(
@@ -27,29 +28,47 @@ async def geolocate_image(
     """
     Upload an image for geolocation analysis
     """
+    image_path = None
     try:
-        # Validate file type
-        file_ext = image.filename.split('.')[-1].lower()
+        # Validate file type, preferring the declared image/* content type over the filename
+        content_type = image.content_type or ''
+        if content_type.startswith('image/'):
+            file_ext = content_type[len('image/'):].lower()
+        else:
+            file_ext = (image.filename or '').rsplit('.', 1)[-1].lower()
         if file_ext not in config.ALLOWED_IMAGE_FORMATS:
-            raise HTTPException(status_code=400, detail=f"File format not supported. Allowed formats: {config.ALLOWED_IMAGE_FORMATS}")
+            raise HTTPException(status_code=400, detail=f"File format not supported. Allowed formats: {', '.join(sorted(config.ALLOWED_IMAGE_FORMATS))}")
         
-        # Check file size
-        contents = await image.read()
-        if len(contents) > config.MAX_IMAGE_SIZE:
-            raise HTTPException(status_code=400, detail=f"File too large. Maximum size: {config.MAX_IMAGE_SIZE} bytes")
-        
-        # Save uploaded image temporarily
-        os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
-        unique_filename = f"{uuid.uuid4()}_{image.filename}"
-        image_path = os.path.join(config.UPLOAD_FOLDER, unique_filename)
-        
-        with open(image_path, "wb") as f:
-            f.write(contents)
+        # Read the upload in chunks, checking size as we go. Small images stay
+        # in memory; larger ones are spilled to a temporary file
+        chunks = []
+        size = 0
+        spill_file = None
+        try:
+            while chunk := await image.read(1 << 16):
+                size += len(chunk)
+                if size > config.MAX_IMAGE_SIZE:
+                    raise HTTPException(status_code=400, detail=f"File too large. Maximum size: {config.MAX_IMAGE_SIZE} bytes")
+                if spill_file is None and size > config.MAX_IN_MEMORY:
+                    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+                    unique_filename = f"{uuid.uuid4()}_{image.filename}"
+                    image_path = os.path.join(config.UPLOAD_FOLDER, unique_filename)
+                    spill_file = open(image_path, "wb")
+                    spill_file.writelines(chunks)
+                    chunks.clear()
+                if spill_file is None:
+                    chunks.append(chunk)
+                else:
+                    spill_file.write(chunk)
+        finally:
+            if spill_file is not None:
+                spill_file.close()
         
         # Create task for image processing agent
-        image_task = {
-            'image_path': image_path
-        }
+        if image_path:
+            image_task = {'image_path': image_path}
+        else:
+            image_task = {'image_data': b''.join(chunks)}
         
         # Process image to extract features and EXIF data
         image_result = await image_agent.execute(image_task)
@@ -70,20 +89,19 @@ async def geolocate_image(
             image_result['image_features']
         )
         
-        # Clean up temporary file
-        os.remove(image_path)
-        
         return {
             "status": "success",
             "result": validated_result
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    finally:
         # Clean up temporary file if it exists
-        if 'image_path' in locals() and os.path.exists(image_path):
+        if image_path and os.path.exists(image_path):
             os.remove(image_path)
-        
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 @router.get("/health")
 async def health_check():
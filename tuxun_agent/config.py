@@ -1,6 +1,6 @@
 # Configuration for TuXun Agent
 import os
-from typing import Optional
+from typing import Any, Dict, Optional
 
 class Config:
     # API Keys and External Services
@@ -14,22 +14,39 @@ class Config:
     MODEL_TEMPERATURE: float = float(os.getenv('MODEL_TEMPERATURE', '0.3'))
     CONFIDENCE_THRESHOLD: float = float(os.getenv('CONFIDENCE_THRESHOLD', '0.7'))
 
+    # Validation weights, as "base,scale" pairs
+    W_CONSISTENCY: tuple = tuple(float(w) for w in os.getenv('W_CONSISTENCY', '0.7,0.3').split(','))
+    W_FEATURE: tuple = tuple(float(w) for w in os.getenv('W_FEATURE', '0.8,0.2').split(','))
+    W_CROSS_VALIDATION: tuple = tuple(float(w) for w in os.getenv('W_CROSS_VALIDATION', '0.7,0.3').split(','))
+    OUTLIER_PENALTY: float = float(os.getenv('OUTLIER_PENALTY', '0.5'))
+    USE_GEOPY_DISTANCE: bool = os.getenv('USE_GEOPY_DISTANCE', 'false').lower() == 'true'
+
     # Database settings
     DATABASE_URL: str = os.getenv('DATABASE_URL', 'sqlite:///geolocation.db')
     VECTOR_DB_PATH: str = os.getenv('VECTOR_DB_PATH', './data/vector_db')
 
     # Processing settings
     MAX_IMAGE_SIZE: int = int(os.getenv('MAX_IMAGE_SIZE', '5000000'))  # 5MB
-    ALLOWED_IMAGE_FORMATS: list = os.getenv('ALLOWED_IMAGE_FORMATS', 'JPEG,PNG,JPG,TIFF').split(',')
+    MAX_IN_MEMORY: int = int(os.getenv('MAX_IN_MEMORY', '5000000'))  # uploads above this are spilled to UPLOAD_FOLDER
+    ALLOWED_IMAGE_FORMATS: frozenset = frozenset(
+        fmt.strip().lower() for fmt in os.getenv('ALLOWED_IMAGE_FORMATS', 'JPEG,PNG,JPG,TIFF').split(',')
+    )
 
     # Agent settings
     MAX_RETRIES: int = int(os.getenv('MAX_RETRIES', '3'))
     TIMEOUT: int = int(os.getenv('TIMEOUT', '30'))
+    LLM_CACHE_TTL: int = int(os.getenv('LLM_CACHE_TTL', '86400'))  # 24 hours
 
     # Paths
     UPLOAD_FOLDER: str = os.getenv('UPLOAD_FOLDER', './uploads')
     DATA_FOLDER: str = os.getenv('DATA_FOLDER', './data')
+    OCEAN_POLYGONS_PATH: str = os.getenv('OCEAN_POLYGONS_PATH', './data/ne_110m_ocean.geojson')
 
     # API Server settings
     API_HOST: str = os.getenv('API_HOST', '0.0.0.0')
     API_PORT: int = int(os.getenv('API_PORT', '8000'))
+
+    @classmethod
+    def as_dict(cls) -> Dict[str, Any]:
+        """Settings as a plain mapping for the agents' config.get(...) lookups"""
+        return {key: getattr(cls, key) for key in dir(cls) if key.isupper()}
@@ -0,0 +1,28 @@
+"""
+Shared pytest fixtures for TuXun Agent
+Configuration and the agents are built once per test session
+"""
+import pytest
+
+from tuxun_agent.config import Config
+from tuxun_agent.agents.image_processing_agent import ImageProcessingAgent
+from tuxun_agent.agents.geolocation_reasoning_agent import GeolocationReasoningAgent
+from tuxun_agent.modules.validation_module import ValidationModule
+
+@pytest.fixture(scope='session')
+def config():
+    return Config()
+
+@pytest.fixture(scope='session')
+def image_agent(config):
+    return ImageProcessingAgent("ImageProcessingAgent", config.as_dict())
+
+@pytest.fixture(scope='session')
+def reasoning_agent(config, tmp_path_factory):
+    # Keep the LLM response cache out of the working tree
+    settings = {**config.as_dict(), 'DATA_FOLDER': str(tmp_path_factory.mktemp('data'))}
+    return GeolocationReasoningAgent("GeolocationReasoningAgent", settings)
+
+@pytest.fixture(scope='session')
+def validation_module(config):
+    return ValidationModule(config.as_dict())
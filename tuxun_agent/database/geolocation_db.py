@@ -3,11 +3,16 @@ Geolocation Database Module for TuXun Agent
 Handles storage and retrieval of geotagged images and location data
 """
 import sqlite3
+import math
 import os
-from typing import List, Dict, Any, Optional
+import pickle
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 import faiss
-import pickle
+from numba import njit
 from dataclasses import dataclass
 
 @dataclass
@@ -19,20 +24,61 @@ class LocationData:
     features: Optional[np.ndarray] = None
     description: Optional[str] = None
 
+def _trig_columns(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    """Precomputed (sin_lat, cos_lat, lon_rad) stored alongside each location"""
+    lat_rad = math.radians(latitude)
+    return math.sin(lat_rad), math.cos(lat_rad), math.radians(longitude)
+
+# Serial on purpose: R-tree candidate sets are small, and a parallel kernel
+# called concurrently from the threadpool aborts under Numba's workqueue layer
+@njit(fastmath=True, cache=True)
+def _within_radius_mask(sin_lats, cos_lats, lon_rads, sin_q, cos_q, lon_q, cos_radius):
+    """Mask of points whose central angle to the query is within the search radius"""
+    mask = np.empty(sin_lats.shape[0], dtype=np.bool_)
+    for i in range(sin_lats.shape[0]):
+        mask[i] = sin_q * sin_lats[i] + cos_q * cos_lats[i] * math.cos(lon_rads[i] - lon_q) >= cos_radius
+    return mask
+
 class GeolocationDB:
-    def __init__(self, db_path: str = "geolocation.db", vector_db_path: str = "vector_db.faiss"):
+    def __init__(self, db_path: str = "geolocation.db", vector_db_path: str = "vector_db.faiss",
+                 flush_every: int = 100, read_only: bool = False):
         self.db_path = db_path
         self.vector_db_path = vector_db_path
+        self.flush_every = flush_every
+        self.read_only = read_only
         self.conn = None
         self.index = None
+        self._pending_vectors: List[np.ndarray] = []
+        self._pending_ids: List[int] = []
+        self._unsaved_vectors = 0
+        self._reindex_features = False
+        self._lock = threading.RLock()
         self._initialize_database()
         self._initialize_vector_db()
     
     def _initialize_database(self):
         """Initialize the SQLite database with required tables"""
-        self.conn = sqlite3.connect(self.db_path)
-        cursor = self.conn.cursor()
+        # One shared autocommit connection, serialized by self._lock so it can be
+        # used from FastAPI's threadpool; writes use explicit transactions
+        if self.read_only:
+            # SQLite itself refuses writes, and no schema changes or migrations run
+            uri = Path(self.db_path).absolute().as_uri() + '?mode=ro'
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        else:
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA cache_size=-64000')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
         
+        if self.read_only:
+            self._reindex_features = self.conn.execute('PRAGMA user_version').fetchone()[0] < 2
+        else:
+            with self._transaction() as cursor:
+                self._create_tables(cursor)
+    
+    def _create_tables(self, cursor: sqlite3.Cursor):
+        """Create the required tables and indexes if they don't exist"""
         # Create locations table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS locations (
@@ -41,10 +87,39 @@ class GeolocationDB:
                 longitude REAL NOT NULL,
                 image_path TEXT,
                 description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sin_lat REAL,
+                cos_lat REAL,
+                lon_rad REAL
             )
         ''')
         
+        # Add and backfill the precomputed trig columns on databases created without them
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(locations)')}
+        for column in ('sin_lat', 'cos_lat', 'lon_rad'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE locations ADD COLUMN {column} REAL')
+        cursor.execute('SELECT id, latitude, longitude FROM locations WHERE sin_lat IS NULL')
+        cursor.executemany(
+            'UPDATE locations SET sin_lat = ?, cos_lat = ?, lon_rad = ? WHERE id = ?',
+            [(*_trig_columns(lat, lon), location_id) for location_id, lat, lon in cursor.fetchall()]
+        )
+        
+        # Create spatial index over location points for radius searches
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree(
+                id, min_lat, max_lat, min_lon, max_lon
+            )
+        ''')
+        
+        # Index any locations stored before the spatial index existed
+        cursor.execute('''
+            INSERT INTO locations_rtree (id, min_lat, max_lat, min_lon, max_lon)
+            SELECT id, latitude, latitude, longitude, longitude
+            FROM locations
+            WHERE id NOT IN (SELECT id FROM locations_rtree)
+        ''')
+        
         # Create image features table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS image_features (
@@ -56,64 +131,218 @@ class GeolocationDB:
             )
         ''')
         
-        self.conn.commit()
+        # Databases written before raw float32 storage hold pickled arrays;
+        # re-encode them once, tracked through the schema's user_version
+        user_version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if user_version < 1:
+            self._migrate_pickled_features(cursor)
+        
+        # Index files saved before version 2 are keyed by location id rather than
+        # feature row id, so they have to be rebuilt from the stored features
+        if user_version < 2:
+            self._reindex_features = True
+            cursor.execute('PRAGMA user_version = 2')
+    
+    def _migrate_pickled_features(self, cursor: sqlite3.Cursor):
+        """Re-encode pickled numpy feature vectors as raw little-endian float32"""
+        updates = []
+        for feature_id, blob in cursor.execute('SELECT id, feature_vector FROM image_features').fetchall():
+            # Pickle protocol 2+ header and STOP opcode; raw float32 rows are left alone
+            if not blob or blob[:1] != b'\x80' or blob[-1:] != b'.':
+                continue
+            try:
+                vector = pickle.loads(blob)
+            except Exception:
+                continue
+            if isinstance(vector, np.ndarray):
+                updates.append((vector.astype('<f4').ravel().tobytes(), feature_id))
+        cursor.executemany('UPDATE image_features SET feature_vector = ? WHERE id = ?', updates)
+    
+    def _check_writable(self):
+        """Raise if this instance was opened read-only"""
+        if self.read_only:
+            raise RuntimeError("Cannot write to a read-only GeolocationDB")
+    
+    @contextmanager
+    def _transaction(self):
+        """Run the enclosed statements in a single write transaction"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+    
+    def _new_index(self) -> faiss.Index:
+        """Empty HNSW graph index wrapped in an ID map so search results carry feature row ids"""
+        dimension = 128  # This would match the size of our feature vectors (128 as example)
+        hnsw = faiss.IndexHNSWFlat(dimension, 32)
+        hnsw.hnsw.efConstruction = 40
+        hnsw.hnsw.efSearch = 16
+        return faiss.IndexIDMap2(hnsw)
+    
+    def _rebuild_index(self):
+        """Rebuild the FAISS index from the feature vectors stored in SQLite"""
+        self.index = self._new_index()
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT id, feature_vector FROM image_features ORDER BY id'
+            ).fetchall()
+        
+        vectors, ids = [], []
+        for feature_id, blob in rows:
+            vector = np.frombuffer(blob, dtype='<f4') if blob and len(blob) % 4 == 0 else None
+            if vector is not None and vector.size == self.index.d:
+                vectors.append(vector)
+                ids.append(feature_id)
+            else:
+                print(f"Skipping unreadable feature vector {feature_id}")
+        
+        if vectors:
+            self.index.add_with_ids(np.vstack(vectors), np.array(ids, dtype='int64'))
+        if not self.read_only:
+            faiss.write_index(self.index, self.vector_db_path)
     
     def _initialize_vector_db(self):
         """Initialize the FAISS vector database for similarity search"""
-        # Create a simple FAISS index for image feature vectors (128 dimensions as example)
-        dimension = 128  # This would match the size of our feature vectors
-        self.index = faiss.IndexFlatL2(dimension)
+        self.index = self._new_index()
         
-        # Load existing index if it exists
+        # Load existing index if it exists. FAISS can only memory-map inverted
+        # lists, not HNSW/flat storage, so the file is always read into RAM;
+        # read_only instances rebuild it in memory when needed but never save it
         if os.path.exists(self.vector_db_path):
             self.index = faiss.read_index(self.vector_db_path)
+            
+            # Older index files (e.g. a plain IndexFlatL2) are keyed by insertion
+            # position rather than feature row id and can't take add_with_ids
+            if not isinstance(self.index, faiss.IndexIDMap2):
+                print(f"Rebuilding {self.vector_db_path} from stored features: index has no feature ids")
+                self._rebuild_index()
+            elif self._reindex_features:
+                print(f"Rebuilding {self.vector_db_path} from stored features: index is keyed by location id")
+                self._rebuild_index()
+        
+        # Queued vectors only reach the file on flush; after an unclean exit the
+        # saved index misses rows that SQLite already committed
+        with self._lock:
+            stored = self.conn.execute(
+                'SELECT COUNT(*) FROM image_features WHERE length(feature_vector) = ?',
+                (self.index.d * 4,)
+            ).fetchone()[0]
+        if stored != self.index.ntotal:
+            print(f"Rebuilding {self.vector_db_path} from stored features: "
+                  f"index has {self.index.ntotal} vectors, database has {stored}")
+            self._rebuild_index()
+        
+        # Warm up with a dummy query so the entry pages are resident before the first real search
+        if self.index.ntotal:
+            self.index.search(np.zeros((1, self.index.d), dtype='float32'), 1)
     
     def add_location(self, latitude: float, longitude: float, image_path: str, 
                     description: Optional[str] = None) -> int:
         """Add a new geotagged location to the database"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO locations (latitude, longitude, image_path, description)
-            VALUES (?, ?, ?, ?)
-        ''', (latitude, longitude, image_path, description))
-        
-        location_id = cursor.lastrowid
-        self.conn.commit()
+        self._check_writable()
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO locations (latitude, longitude, image_path, description,
+                                       sin_lat, cos_lat, lon_rad)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (latitude, longitude, image_path, description,
+                  *_trig_columns(latitude, longitude)))
+            
+            location_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO locations_rtree (id, min_lat, max_lat, min_lon, max_lon)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (location_id, latitude, latitude, longitude, longitude))
         
         return location_id
     
+    def add_locations(self, locations: List[Tuple[float, float, str, Optional[str]]]) -> List[int]:
+        """Add many (latitude, longitude, image_path, description) rows in one transaction"""
+        self._check_writable()
+        with self._transaction() as cursor:
+            # AUTOINCREMENT ids only grow, so everything above the current max is ours
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM locations')
+            last_id = cursor.fetchone()[0]
+            
+            cursor.executemany('''
+                INSERT INTO locations (latitude, longitude, image_path, description,
+                                       sin_lat, cos_lat, lon_rad)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(*location, *_trig_columns(location[0], location[1])) for location in locations])
+            
+            cursor.execute('''
+                INSERT INTO locations_rtree (id, min_lat, max_lat, min_lon, max_lon)
+                SELECT id, latitude, latitude, longitude, longitude
+                FROM locations
+                WHERE id > ?
+            ''', (last_id,))
+            
+            cursor.execute('SELECT id FROM locations WHERE id > ? ORDER BY id', (last_id,))
+            return [row[0] for row in cursor.fetchall()]
+    
     def add_image_features(self, location_id: int, feature_vector: np.ndarray, 
                          feature_type: str = "visual"):
         """Add image features for a location"""
-        cursor = self.conn.cursor()
+        self._check_writable()
         
-        # Serialize the feature vector
-        feature_blob = pickle.dumps(feature_vector)
-        
-        cursor.execute('''
-            INSERT INTO image_features (location_id, feature_vector, feature_type)
-            VALUES (?, ?, ?)
-        ''', (location_id, feature_blob, feature_type))
+        # Reject vectors the index can't hold before anything is stored
+        if feature_vector.size != self.index.d:
+            raise ValueError(
+                f"Feature vector has {feature_vector.size} dimensions, index expects {self.index.d}"
+            )
         
-        self.conn.commit()
+        # Serialize the feature vector as raw little-endian float32
+        feature_vector = feature_vector.astype('<f4', copy=False)
+        feature_blob = feature_vector.tobytes()
         
-        # Add to FAISS index
-        feature_vector = feature_vector.astype('float32').reshape(1, -1)
-        self.index.add(feature_vector)
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO image_features (location_id, feature_vector, feature_type)
+                VALUES (?, ?, ?)
+            ''', (location_id, feature_blob, feature_type))
+            feature_id = cursor.lastrowid
         
-        # Save the updated index
-        faiss.write_index(self.index, self.vector_db_path)
+        # Queue for the FAISS index; vectors are added and saved in batches
+        with self._lock:
+            self._pending_vectors.append(feature_vector.reshape(1, -1))
+            self._pending_ids.append(feature_id)
+            if len(self._pending_vectors) >= self.flush_every:
+                self.flush()
+    
+    def _add_pending_vectors(self):
+        """Add queued feature vectors to the FAISS index in a single call"""
+        if self._pending_vectors:
+            ids = np.array(self._pending_ids, dtype='int64')
+            try:
+                self.index.add_with_ids(np.vstack(self._pending_vectors), ids)
+                self._unsaved_vectors += len(ids)
+            finally:
+                # A failed batch must not block every later flush and search
+                self._pending_vectors.clear()
+                self._pending_ids.clear()
+    
+    def flush(self):
+        """Add queued feature vectors to the index and save it to disk"""
+        with self._lock:
+            self._add_pending_vectors()
+            if self._unsaved_vectors:
+                faiss.write_index(self.index, self.vector_db_path)
+                self._unsaved_vectors = 0
     
     def get_location_by_id(self, location_id: int) -> Optional[LocationData]:
         """Retrieve a location by its ID"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT id, latitude, longitude, image_path, description
-            FROM locations
-            WHERE id = ?
-        ''', (location_id,))
+        with self._lock:
+            row = self.conn.execute('''
+                SELECT id, latitude, longitude, image_path, description
+                FROM locations
+                WHERE id = ?
+            ''', (location_id,)).fetchone()
         
-        row = cursor.fetchone()
         if row:
             return LocationData(
                 id=row[0],
@@ -124,70 +353,151 @@ class GeolocationDB:
             )
         return None
     
+    def get_locations_by_ids(self, location_ids: List[int]) -> Dict[int, LocationData]:
+        """Retrieve several locations in one query, keyed by ID"""
+        if not location_ids:
+            return {}
+        
+        placeholders = ','.join('?' * len(location_ids))
+        with self._lock:
+            rows = self.conn.execute(f'''
+                SELECT id, latitude, longitude, image_path, description
+                FROM locations
+                WHERE id IN ({placeholders})
+            ''', list(location_ids)).fetchall()
+        
+        return {
+            row[0]: LocationData(
+                id=row[0],
+                latitude=row[1],
+                longitude=row[2],
+                image_path=row[3],
+                description=row[4]
+            )
+            for row in rows
+        }
+    
+    def _location_ids_for_features(self, feature_ids: List[int]) -> Dict[int, int]:
+        """Map image_features row ids to their location ids"""
+        if not feature_ids:
+            return {}
+        
+        placeholders = ','.join('?' * len(feature_ids))
+        with self._lock:
+            rows = self.conn.execute(f'''
+                SELECT id, location_id
+                FROM image_features
+                WHERE id IN ({placeholders})
+            ''', list(feature_ids)).fetchall()
+        
+        return dict(rows)
+    
+    def get_image_features(self, location_id: int) -> List[np.ndarray]:
+        """Retrieve the stored feature vectors for a location"""
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT feature_vector
+                FROM image_features
+                WHERE location_id = ?
+            ''', (location_id,)).fetchall()
+        
+        return [np.frombuffer(row[0], dtype='<f4') for row in rows]
+    
     def find_similar_locations(self, query_features: np.ndarray, k: int = 5) -> List[LocationData]:
         """Find locations with similar image features using FAISS"""
-        if query_features.size != self.index.d:
-            # Resize or handle dimension mismatch
-            if query_features.size > self.index.d:
-                query_features = query_features[:self.index.d]
-            else:
-                # Pad with zeros
-                padded = np.zeros(self.index.d)
-                padded[:query_features.size] = query_features
-                query_features = padded
-        
-        query_features = query_features.astype('float32').reshape(1, -1)
-        
-        # Search for similar vectors
-        distances, indices = self.index.search(query_features, k)
-        
-        # Retrieve location data for the similar indices
-        similar_locations = []
-        for idx in indices[0]:
-            if idx != -1:  # FAISS returns -1 for empty slots
-                # In a real implementation, we'd map the FAISS index to our database ID
-                # For now, we'll return empty location data
-                similar_locations.append(LocationData(
-                    id=idx,
-                    latitude=0.0,
-                    longitude=0.0,
-                    image_path="",
-                    description="Similar location"
-                ))
+        return self.find_similar_locations_batch(query_features.reshape(1, -1), k)[0]
+    
+    def find_similar_locations_batch(self, query_features: np.ndarray, k: int = 5) -> List[List[LocationData]]:
+        """Find similar locations for a (B, d) batch of queries with a single FAISS search"""
+        dim = query_features.shape[1]
+        if dim > self.index.d:
+            query_features = query_features[:, :self.index.d]
+        elif dim < self.index.d:
+            # Pad with zeros
+            query_features = np.pad(query_features, ((0, 0), (0, self.index.d - dim)))
+        
+        query_features = np.ascontiguousarray(query_features, dtype='float32')
+        
+        # Search for similar vectors. FAISS indexes are not safe to search while
+        # another thread adds to them, so searches share the writers' lock.
+        # Several feature rows can belong to one location, so over-fetch and
+        # keep the first k distinct locations per query
+        with self._lock:
+            self._add_pending_vectors()
+            fetch = max(k, min(k * 4, self.index.ntotal))
+            distances, indices = self.index.search(query_features, fetch)
+        
+        # Map returned feature row ids to locations, one query each
+        found_ids = {int(idx) for idx in indices.ravel() if idx != -1}  # FAISS returns -1 for empty slots
+        feature_locations = self._location_ids_for_features(sorted(found_ids))
+        locations = self.get_locations_by_ids(sorted(set(feature_locations.values())))
         
-        return similar_locations
+        results = []
+        for row in indices:
+            location_ids = []
+            for idx in row.tolist():
+                location_id = feature_locations.get(idx)
+                if location_id in locations and location_id not in location_ids:
+                    location_ids.append(location_id)
+                    if len(location_ids) == k:
+                        break
+            results.append([locations[location_id] for location_id in location_ids])
+        return results
     
     def search_by_coordinates(self, latitude: float, longitude: float, 
                            radius_km: float = 10.0) -> List[LocationData]:
         """Search for locations within a radius of the given coordinates"""
-        # Simple implementation using haversine formula
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT id, latitude, longitude, image_path, description
-            FROM locations
-            WHERE 6371 * acos(
-                cos(radians(?)) * 
-                cos(radians(latitude)) * 
-                cos(radians(longitude) - radians(?)) + 
-                sin(radians(?)) * 
-                sin(radians(latitude))
-            ) <= ?
-        ''', (latitude, longitude, latitude, radius_km))
-        
-        rows = cursor.fetchall()
+        # Bounding box of the search circle, used to prefilter through the R-tree
+        angular_radius = radius_km / 6371.0
+        dlat = math.degrees(angular_radius)
+        query = '''
+            SELECT l.id, l.latitude, l.longitude, l.image_path, l.description,
+                   l.sin_lat, l.cos_lat, l.lon_rad
+            FROM locations_rtree r
+            JOIN locations l ON l.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ?
+        '''
+        params = [latitude - dlat, latitude + dlat]
+        
+        # Longitude bounds only apply when the circle doesn't contain a pole
+        # or cross the antimeridian
+        sin_dlon = math.sin(angular_radius) / max(math.cos(math.radians(latitude)), 1e-12)
+        if sin_dlon < 1:
+            dlon = math.degrees(math.asin(sin_dlon))
+            if -180 <= longitude - dlon and longitude + dlon <= 180:
+                query += ' AND r.max_lon >= ? AND r.min_lon <= ?'
+                params += [longitude - dlon, longitude + dlon]
+        
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        if not rows:
+            return []
+        
+        # Refine candidates with the spherical law of cosines on the precomputed
+        # columns: inside the circle iff cos(central angle) >= cos(angular radius)
+        count = len(rows)
+        sin_lats = np.fromiter((row[5] for row in rows), dtype=np.float64, count=count)
+        cos_lats = np.fromiter((row[6] for row in rows), dtype=np.float64, count=count)
+        lon_rads = np.fromiter((row[7] for row in rows), dtype=np.float64, count=count)
+        sin_q, cos_q, lon_q = _trig_columns(latitude, longitude)
+        within = _within_radius_mask(sin_lats, cos_lats, lon_rads, sin_q, cos_q, lon_q,
+                                     math.cos(angular_radius))
+        
         locations = []
-        for row in rows:
-            locations.append(LocationData(
-                id=row[0],
-                latitude=row[1],
-                longitude=row[2],
-                image_path=row[3],
-                description=row[4]
-            ))
+        for row, inside in zip(rows, within):
+            if inside:
+                locations.append(LocationData(
+                    id=row[0],
+                    latitude=row[1],
+                    longitude=row[2],
+                    image_path=row[3],
+                    description=row[4]
+                ))
         
         return locations
     
     def close(self):
         """Close database connections"""
+        self.flush()
         if self.conn:
             self.conn.close()
\ No newline at end of file
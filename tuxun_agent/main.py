@@ -4,21 +4,37 @@ A Manus-like tool for image geolocation
 """
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from .api.geolocation_api import router as geolocation_router
+from .agents.geolocation_reasoning_agent import close_async_client
 from .config import Config
 
 # Create FastAPI app
 app = FastAPI(
     title="TuXun Agent",
     description="A Manus-like tool for image geolocation",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Include API routes
 app.include_router(geolocation_router, prefix="/api/v1")
 
+@app.on_event("startup")
+async def startup():
+    # Size the default executor used by asyncio.to_thread for CPU-bound image analysis
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2))
+    )
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Release pooled HTTP connections held by the agents
+    await close_async_client()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to TuXun Agent - Image Geolocation Service"}
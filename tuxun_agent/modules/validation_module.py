@@ -2,37 +2,321 @@
 Validation Module for TuXun Agent
 Validates geolocation results and provides confidence scoring
 """
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+import functools
 import math
-from geopy.distance import geodesic
+import os
+import numpy as np
+import orjson
+
+# pyproj and numba are imported on first use; together they dominate this
+# module's import time and most calls never need them
+
+@functools.lru_cache(maxsize=None)
+def _geod():
+    """Shared WGS84 ellipsoid; distances are computed by GeographicLib in C"""
+    from pyproj import Geod
+    return Geod(ellps="WGS84")
+
+def _geodesic_km(lat0: float, lon0: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """WGS84 geodesic distances in km from one point to arrays of points (all in degrees)"""
+    _, _, dist_m = _geod().inv(np.full_like(lons, lon0), np.full_like(lats, lat0), lons, lats)
+    return np.asarray(dist_m) / 1000.0
+
+EARTH_RADIUS_KM = 6371.0
+
+def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in km between two points; math on scalars beats numpy for a single pair"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    sin_half_dlat = math.sin((lat2_rad - lat1_rad) * 0.5)
+    sin_half_dlon = math.sin(math.radians(lon2 - lon1) * 0.5)
+    a = sin_half_dlat * sin_half_dlat + math.cos(lat1_rad) * math.cos(lat2_rad) * sin_half_dlon * sin_half_dlon
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+def _geopy_geodesic():
+    """geopy's geodesic, imported on first use; only needed when USE_GEOPY_DISTANCE is set"""
+    import geopy.distance
+    return geopy.distance.geodesic
+
+# Haversine term sin^2(d / 2R) at the low edge of the band around the 1 km
+# cross-validation radius where WGS84 and the sphere can disagree (within ~0.6%)
+_AGREEMENT_KM_LOW = 0.994
+_AGREEMENT_HAV_LOW = math.sin(0.5 * _AGREEMENT_KM_LOW / EARTH_RADIUS_KM) ** 2
+
+def _haversine_term(lat0: float, lon0: float, lats: np.ndarray, lons: np.ndarray,
+                    cos_lats: np.ndarray = None) -> np.ndarray:
+    """
+    Haversine term a = sin^2(c / 2) of the central angle c, without the sqrt/arcsin.
+    cos_lats may be passed in when the same point set is compared against several origins
+    """
+    lat0_rad = math.radians(lat0)
+    lats_rad = np.deg2rad(lats)
+    # cos(lat0) is a scalar shared by every point: one libm call instead of N
+    cos_lat0 = math.cos(lat0_rad)
+    if cos_lats is None:
+        cos_lats = np.cos(lats_rad)
+    sin_half_dlat = np.sin((lats_rad - lat0_rad) * 0.5)
+    sin_half_dlon = np.sin(np.deg2rad(lons - lon0) * 0.5)
+    return sin_half_dlat * sin_half_dlat + cos_lat0 * cos_lats * (sin_half_dlon * sin_half_dlon)
+
+def _equirect_km(lat0, lon0, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Equirectangular approximation of distances in km (lat0/lon0 may be scalars or arrays).
+    Accurate enough for the 1 / (1 + d / 10) consistency mapping, without sin/arcsin
+    """
+    dlon = (lons - lon0 + 180.0) % 360.0 - 180.0  # Shortest way round the antimeridian
+    dx = np.deg2rad(dlon) * np.cos(np.deg2rad(lat0)) * EARTH_RADIUS_KM
+    dy = np.deg2rad(lats - lat0) * EARTH_RADIUS_KM
+    return np.hypot(dx, dy)
+
+def _unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """(k, 3) unit vectors on the sphere for coordinates in degrees"""
+    lats_rad = np.deg2rad(lats)
+    lons_rad = np.deg2rad(lons)
+    cos_lats = np.cos(lats_rad)
+    return np.column_stack((cos_lats * np.cos(lons_rad), cos_lats * np.sin(lons_rad), np.sin(lats_rad)))
+
+def _valid_coords(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Mask of finite coordinates within latitude/longitude range"""
+    return np.isfinite(lats) & np.isfinite(lons) & (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+
+def _valid_coord(lat: float, lon: float) -> bool:
+    """Scalar _valid_coords with plain comparisons; NaN and inf fail them, so no isfinite call is needed"""
+    return -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0
+
+def _as_float(value: Any) -> float:
+    """Coordinate as float (numeric strings included); None or unparsable values become NaN and are masked out later"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _coords_from(items: List[Dict[str, Any]], default_confidence: Optional[float] = None
+                 ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Latitude, longitude and confidence arrays (structure-of-arrays) from a list of location dicts.
+    Confidences are only read when a default_confidence is given, otherwise None is returned;
+    missing or non-numeric confidences fall back to the default rather than turning into NaN
+    """
+    count = len(items)
+    lats = np.fromiter((_as_float(item.get('latitude', 0)) for item in items), dtype=np.float64, count=count)
+    lons = np.fromiter((_as_float(item.get('longitude', 0)) for item in items), dtype=np.float64, count=count)
+    confs = None
+    if default_confidence is not None:
+        confs = np.fromiter((_as_float(item.get('confidence', default_confidence)) for item in items),
+                            dtype=np.float64, count=count)
+        confs[~np.isfinite(confs)] = default_confidence
+    return lats, lons, confs
+
+def _outlier_mask(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Branchless outlier test over arrays: invalid coordinates or the known Pacific ocean box"""
+    return (~_valid_coords(lats, lons) |
+            ((lats > -5) & (lats < 5) & (lons > -170) & (lons < -160)))
+
+def _load_ocean_tree(path: str):
+    """
+    STRtree over the ocean polygons of a GeoJSON file (e.g. Natural Earth ne_110m_ocean),
+    or None when the file or shapely is unavailable
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        import shapely
+        from shapely.geometry import shape
+        with open(path, 'rb') as f:
+            geojson = orjson.loads(f.read())
+        features = geojson.get('features', [geojson]) if isinstance(geojson, dict) else []
+        polygons = [shape(feature.get('geometry', feature)) for feature in features]
+        return shapely.STRtree(polygons) if polygons else None
+    except Exception as e:
+        print(f"Error loading ocean polygons from {path}: {str(e)}")
+        return None
+
+def _adjust_kernel(original_confidence, consistency, feature, is_outlier,
+                   cons_base, cons_scale, feat_base, feat_scale, outlier_penalty):
+    """Confidence after consistency/feature weighting and the outlier penalty, clipped to [0, 1]"""
+    adjusted = original_confidence * (cons_base + cons_scale * consistency) * (feat_base + feat_scale * feature)
+    if is_outlier:
+        adjusted *= outlier_penalty  # Significant penalty for outliers
+    return min(max(adjusted, 0.0), 1.0)
+
+@functools.lru_cache(maxsize=None)
+def _adjust_ufunc():
+    """Element-wise Numba version of _adjust_kernel for the batch path, compiled on first use"""
+    from numba import boolean, float64, vectorize
+    return vectorize(
+        [float64(float64, float64, float64, boolean, float64, float64, float64, float64, float64)], cache=True
+    )(_adjust_kernel)
+
+def _compile_adjust(cons_base: float, cons_scale: float, feat_base: float, 
+                    feat_scale: float, outlier_penalty: float):
+    """
+    Plain-Python _adjust_kernel with one weight set baked in as constants,
+    generated once per ValidationModule for the scalar hot path
+    """
+    source = (
+        "def _adjust_fast(original_confidence, consistency, feature, is_outlier):\n"
+        f"    adjusted = original_confidence * ({cons_base!r} + {cons_scale!r} * consistency)"
+        f" * ({feat_base!r} + {feat_scale!r} * feature)\n"
+        "    if is_outlier:\n"
+        f"        adjusted *= {outlier_penalty!r}\n"
+        "    return min(max(adjusted, 0.0), 1.0)\n"
+    )
+    namespace = {}
+    exec(compile(source, '<validation_adjust_fast>', 'exec'), namespace)
+    return namespace['_adjust_fast']
 
 class ValidationModule:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.confidence_threshold = config.get('CONFIDENCE_THRESHOLD', 0.7)
+        # Confidence weights as (base, scale) pairs, bound once so the hot paths only read attributes
+        self._w_cons_base, self._w_cons_scale = map(float, config.get('W_CONSISTENCY', (0.7, 0.3)))
+        self._w_feat_base, self._w_feat_scale = map(float, config.get('W_FEATURE', (0.8, 0.2)))
+        self._outlier_penalty = float(config.get('OUTLIER_PENALTY', 0.5))
+        self._w_cv_base, self._w_cv_scale = map(float, config.get('W_CROSS_VALIDATION', (0.7, 0.3)))
+        # The weights are floats at this point, so they can be inlined safely
+        self._adjust_fast = _compile_adjust(self._w_cons_base, self._w_cons_scale,
+                                            self._w_feat_base, self._w_feat_scale, self._outlier_penalty)
+        # Legacy: report discrepancy distances with geopy instead of pyproj
+        self._use_geopy = bool(config.get('USE_GEOPY_DISTANCE', False))
+        # Landmask lookups are memoized per instance on coordinates rounded to
+        # 3 decimals (~110 m grid): ranked candidate lists repeat near-identical locations
+        self._landmask_cached = functools.lru_cache(maxsize=4096)(self._landmask_outlier)
+        # Ocean landmask for outlier detection; None keeps the built-in bounds check
+        self._ocean_tree = _load_ocean_tree(
+            config.get('OCEAN_POLYGONS_PATH', './data/ne_110m_ocean.geojson')
+        )
     
     def validate_location_prediction(self, prediction: Dict[str, Any], 
                                   image_features: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Validate a location prediction and adjust confidence based on various factors
         """
-        validated_result = prediction.copy()
+        pred = prediction.get('predicted_location') or {}
         
         # Calculate additional validation metrics
         validation_metrics = self._calculate_validation_metrics(prediction, image_features)
         
         # Update confidence based on validation
-        adjusted_confidence = self._adjust_confidence(
-            prediction.get('predicted_location', {}).get('confidence', 0.5),
-            validation_metrics
+        adjusted_confidence = self._adjust_fast(
+            float(pred.get('confidence', 0.5)),
+            validation_metrics['consistency_score'],
+            validation_metrics['feature_matching_score'],
+            validation_metrics['outlier_detection']
         )
         
-        # Update the prediction with validation results
-        validated_result['predicted_location']['confidence'] = adjusted_confidence
-        validated_result['validation_metrics'] = validation_metrics
-        validated_result['is_reliable'] = adjusted_confidence >= self.confidence_threshold
+        # Fresh result dict sharing the unchanged fields; the caller's
+        # prediction (and its nested predicted_location) is left untouched
+        return {
+            **prediction,
+            'predicted_location': {**pred, 'confidence': adjusted_confidence},
+            'validation_metrics': validation_metrics,
+            'is_reliable': adjusted_confidence >= self.confidence_threshold
+        }
+    
+    def validate_batch(self, predictions: List[Dict[str, Any]], 
+                       image_features: Dict[str, Any] = None,
+                       shared_alternatives: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Validate many predictions (e.g. a ranked candidate list for one image) at once.
+        Coordinates are gathered into flat arrays so every score is computed with
+        a handful of vector operations instead of per-prediction Python calls.
+        With shared_alternatives (e.g. an ensemble's pooled candidates), every
+        prediction is scored against that one pool instead of its own alternatives
+        """
+        n = len(predictions)
+        if n == 0:
+            return []
+        
+        # Predictions as structure-of-arrays
+        pred_locs = [p.get('predicted_location') or {} for p in predictions]
+        pred_lat, pred_lon, orig_conf = _coords_from(pred_locs, 0.5)
         
-        return validated_result
+        if shared_alternatives is not None:
+            consistency = self._shared_pool_consistency(pred_lat, pred_lon, shared_alternatives)
+        else:
+            # All alternatives flattened into one array, with owner[i] the index of
+            # the prediction each alternative belongs to
+            alt_lists = [p.get('alternative_locations', []) for p in predictions]
+            alt_counts = np.fromiter((len(alts) for alts in alt_lists), dtype=np.int64, count=n)
+            alt_lat, alt_lon, _ = _coords_from([alt for alts in alt_lists for alt in alts])
+            owner = np.repeat(np.arange(n), alt_counts)
+        
+            # Alternatives (and predictions) with missing or out-of-range
+            # coordinates are filtered up front instead of failing in the distance call
+            valid = _valid_coords(alt_lat, alt_lon) & _valid_coords(pred_lat, pred_lon)[owner]
+            owner = owner[valid]
+            distances = _equirect_km(pred_lat[owner], pred_lon[owner], alt_lat[valid], alt_lon[valid])
+            
+            # Per-prediction mean distance -> consistency, matching the scalar path:
+            # 0.0 without alternatives, 1.0 when none of them are usable
+            dist_sums = np.bincount(owner, weights=distances, minlength=n)
+            valid_counts = np.bincount(owner, minlength=n)
+            avg_distance = dist_sums / np.maximum(valid_counts, 1)
+            consistency = np.where(valid_counts > 0, np.minimum(1 / (1 + avg_distance / 10), 1.0), 1.0)
+            consistency = np.where(alt_counts > 0, consistency, 0.0)
+        
+        feature_score = 0.0
+        if image_features:
+            feature_score = self._check_feature_consistency({}, image_features)
+        
+        outliers = self._outlier_mask_landmask(pred_lat, pred_lon)
+        
+        adjusted = _adjust_ufunc()(orig_conf, consistency, feature_score, outliers,
+                                   self._w_cons_base, self._w_cons_scale,
+                                   self._w_feat_base, self._w_feat_scale, self._outlier_penalty)
+        
+        results = []
+        for i, (prediction, loc) in enumerate(zip(predictions, pred_locs)):
+            is_outlier = bool(outliers[i])
+            confidence = float(adjusted[i])
+            results.append({
+                **prediction,
+                'predicted_location': {**loc, 'confidence': confidence},
+                'validation_metrics': {
+                    'consistency_score': float(consistency[i]),
+                    'feature_matching_score': feature_score,
+                    'confidence_calibration': 1.0,
+                    'outlier_detection': is_outlier,
+                    'validation_notes': ["Predicted location appears to be an outlier"] if is_outlier else []
+                },
+                'is_reliable': confidence >= self.confidence_threshold
+            })
+        
+        return results
+    
+    def _shared_pool_consistency(self, pred_lat: np.ndarray, pred_lon: np.ndarray, 
+                                 alternatives: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Consistency of every prediction against one shared pool of alternatives,
+        from an N x M great-circle distance matrix
+        """
+        n = len(pred_lat)
+        if not alternatives:
+            return np.zeros(n)
+        
+        # scipy is only needed for this path
+        from scipy.spatial.distance import cdist
+        
+        alt_lat, alt_lon, _ = _coords_from(alternatives)
+        alt_valid = _valid_coords(alt_lat, alt_lon)
+        pred_valid = _valid_coords(pred_lat, pred_lon)
+        consistency = np.ones(n)  # 1.0 when none of the alternatives are usable
+        if not alt_valid.any() or not pred_valid.any():
+            return consistency
+        
+        alt_lat, alt_lon = alt_lat[alt_valid], alt_lon[alt_valid]
+        
+        # Chord length between unit vectors, computed in C by cdist, then
+        # converted to the great-circle distance: d = 2R * arcsin(chord / 2)
+        chord = cdist(_unit_vectors(pred_lat[pred_valid], pred_lon[pred_valid]),
+                      _unit_vectors(alt_lat, alt_lon), 'euclidean')
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord * 0.5, 1.0))
+        avg_distance = distances.mean(axis=1)
+        consistency[pred_valid] = np.minimum(np.reciprocal(1 + avg_distance / 10), 1.0)
+        return consistency
     
     def _calculate_validation_metrics(self, prediction: Dict[str, Any], 
                                    image_features: Dict[str, Any] = None) -> Dict[str, Any]:
@@ -48,15 +332,18 @@ class ValidationModule:
         }
         
         # Check consistency between predicted location and alternative locations
-        predicted_loc = prediction.get('predicted_location', {})
+        predicted_loc = prediction.get('predicted_location') or {}
         alternatives = prediction.get('alternative_locations', [])
         
         if alternatives:
+            # Build the alternatives' coordinate arrays once; every
+            # per-alternative score below works on these same buffers
+            alt_lats, alt_lons, _ = _coords_from(alternatives)
+            
             # Calculate consistency with alternatives
-            consistency_score = self._check_consistency_with_alternatives(
-                predicted_loc, alternatives
+            metrics['consistency_score'] = self._consistency_from_coords(
+                predicted_loc, alt_lats, alt_lons
             )
-            metrics['consistency_score'] = consistency_score
         
         # If we have image features, check if they're consistent with the location
         if image_features:
@@ -73,32 +360,25 @@ class ValidationModule:
         
         return metrics
     
-    def _check_consistency_with_alternatives(self, predicted_loc: Dict[str, Any], 
-                                           alternatives: List[Dict[str, Any]]) -> float:
+    def _consistency_from_coords(self, predicted_loc: Dict[str, Any], 
+                                 lats: np.ndarray, lons: np.ndarray) -> float:
         """
-        Check how consistent the main prediction is with alternative predictions
+        Consistency score from the alternatives' coordinate arrays
         """
-        if not alternatives:
-            return 1.0  # No alternatives to compare with
-        
-        predicted_coords = (predicted_loc.get('latitude', 0), 
-                           predicted_loc.get('longitude', 0))
-        
-        # Calculate distances to alternatives
-        distances = []
-        for alt in alternatives:
-            alt_coords = (alt.get('latitude', 0), alt.get('longitude', 0))
-            try:
-                distance = geodesic(predicted_coords, alt_coords).kilometers
-                distances.append(distance)
-            except:
-                continue
-        
-        if not distances:
+        # Skip alternatives with invalid coordinates
+        lat0 = _as_float(predicted_loc.get('latitude', 0))
+        lon0 = _as_float(predicted_loc.get('longitude', 0))
+        if not _valid_coord(lat0, lon0):
             return 1.0
+        valid = _valid_coords(lats, lons)
+        if not valid.any():
+            return 1.0
+        
+        # Calculate distances to all alternatives in one vectorized pass
+        distances = _equirect_km(lat0, lon0, lats[valid], lons[valid])
         
         # Calculate consistency (inverse of average distance to alternatives)
-        avg_distance = sum(distances) / len(distances)
+        avg_distance = float(distances.mean())
         
         # Normalize to 0-1 scale (lower distance = higher consistency)
         # Using a sigmoid-like function to map distances to consistency scores
@@ -122,107 +402,175 @@ class ValidationModule:
         """
         Check if the predicted location is an outlier (e.g., ocean, uninhabited area)
         """
-        lat = predicted_loc.get('latitude', 0)
-        lon = predicted_loc.get('longitude', 0)
+        lat = _as_float(predicted_loc.get('latitude', 0))
+        lon = _as_float(predicted_loc.get('longitude', 0))
         
-        # Basic checks for obviously wrong locations
-        if abs(lat) > 90 or abs(lon) > 180:
-            return True  # Invalid coordinates
-        
-        # Check if it's in the middle of an ocean (very simplified)
-        # This would require more sophisticated geographic data in practice
-        if -5 < lat < 5 and -170 < lon < -160:
-            # Pacific Ocean area
+        # Invalid coordinates are always outliers
+        if not _valid_coord(lat, lon):
             return True
+        if self._ocean_tree is not None:
+            return self._landmask_cached(round(lat, 3), round(lon, 3))
         
-        return False
+        # In the middle of an ocean (very simplified, Pacific Ocean area)
+        return -5 < lat < 5 and -170 < lon < -160
+    
+    def _landmask_outlier(self, lat: float, lon: float) -> bool:
+        """
+        Landmask check for rounded, valid coordinates; memoized per instance in __init__
+        """
+        return bool(self._outlier_mask_landmask(np.array([lat]), np.array([lon]))[0])
+    
+    def _outlier_mask_landmask(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """
+        Outlier mask over arrays: invalid coordinates or points inside an ocean polygon.
+        Falls back to the bounds check when no landmask is loaded
+        """
+        if self._ocean_tree is None:
+            return _outlier_mask(lats, lons)
+        
+        import shapely
+        mask = ~_valid_coords(lats, lons)
+        candidates = np.flatnonzero(~mask)
+        if candidates.size:
+            # One STRtree query for all points, on the same ~110 m grid as the
+            # memoized scalar check; row 0 holds the indices of matching points
+            points = shapely.points(np.round(lons[candidates], 3), np.round(lats[candidates], 3))
+            hits = self._ocean_tree.query(points, predicate='intersects')
+            mask[candidates[hits[0]]] = True
+        return mask
     
     def _adjust_confidence(self, original_confidence: float, 
                           validation_metrics: Dict[str, Any]) -> float:
         """
         Adjust confidence based on validation metrics
         """
-        # Start with original confidence
-        adjusted_confidence = original_confidence
-        
-        # Apply consistency adjustment
-        consistency_factor = validation_metrics.get('consistency_score', 0.5)
-        adjusted_confidence *= (0.7 + 0.3 * consistency_factor)  # Weighted adjustment
-        
-        # Apply feature matching adjustment
-        feature_factor = validation_metrics.get('feature_matching_score', 0.5)
-        adjusted_confidence *= (0.8 + 0.2 * feature_factor)
-        
-        # Apply outlier penalty
-        if validation_metrics.get('outlier_detection', False):
-            adjusted_confidence *= 0.5  # Significant penalty for outliers
-        
-        # Ensure confidence is within bounds
-        adjusted_confidence = max(0.0, min(1.0, adjusted_confidence))
-        
-        return adjusted_confidence
+        return _adjust_kernel(
+            float(original_confidence),
+            float(validation_metrics.get('consistency_score', 0.5)),
+            float(validation_metrics.get('feature_matching_score', 0.5)),
+            bool(validation_metrics.get('outlier_detection', False)),
+            self._w_cons_base, self._w_cons_scale,
+            self._w_feat_base, self._w_feat_scale, self._outlier_penalty
+        )
+    
+    def _discrepancy_km(self, lat0: float, lon0: float, 
+                        lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """
+        Reported distances to sources near or past 1 km: WGS84 via pyproj, or geopy in legacy mode
+        """
+        if self._use_geopy and lats.size:
+            geodesic = _geopy_geodesic()
+            return np.array([geodesic((lat0, lon0), (lat1, lon1)).kilometers
+                             for lat1, lon1 in zip(lats.tolist(), lons.tolist())])
+        return _geodesic_km(lat0, lon0, lats, lons)
+    
+    def _distance_km(self, lat0: float, lon0: float, lat1: float, lon1: float) -> float:
+        """
+        Scalar counterpart of _discrepancy_km for a single source
+        """
+        if self._use_geopy:
+            return _geopy_geodesic()((lat0, lon0), (lat1, lon1)).kilometers
+        return _geod().inv(lon0, lat0, lon1, lat1)[2] / 1000.0
     
     def cross_validate_with_external_sources(self, prediction: Dict[str, Any], 
                                           external_data: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
         Cross-validate prediction with external data sources
         """
+        pred = prediction.get('predicted_location') or {}
+        lat = _as_float(pred.get('latitude', 0))
+        lon = _as_float(pred.get('longitude', 0))
+        base_confidence = pred.get('confidence', 0.5)
+        
         validation_result = {
             'cross_validation_score': 0.0,
             'external_agreement': [],
             'discrepancies': [],
-            'final_confidence': prediction.get('predicted_location', {}).get('confidence', 0.5)
+            'final_confidence': base_confidence
         }
         
-        predicted_coords = (
-            prediction.get('predicted_location', {}).get('latitude', 0),
-            prediction.get('predicted_location', {}).get('longitude', 0)
-        )
+        predicted_coords = (lat, lon)
         
-        if not external_data:
+        if not external_data or not _valid_coord(lat, lon):
             return validation_result
         
+        count = len(external_data)
+        lats, lons, confs = _coords_from(external_data, 0.8)
         agreements = []
         discrepancies = []
-        
-        for source_data in external_data:
-            source_coords = (source_data.get('latitude', 0), source_data.get('longitude', 0))
-            
-            try:
-                distance = geodesic(predicted_coords, source_coords).kilometers
-                
-                if distance < 1:  # Less than 1km considered agreement
+        if count == 1:
+            # A single source is cheaper with scalar math than with numpy temporaries
+            source = external_data[0]
+            src_lat, src_lon, confidence = float(lats[0]), float(lons[0]), float(confs[0])
+            if _valid_coord(src_lat, src_lon):
+                d_km = _haversine_km(lat, lon, src_lat, src_lon)
+                if d_km >= _AGREEMENT_KM_LOW:
+                    d_km = self._distance_km(lat, lon, src_lat, src_lon)
+                if d_km < 1.0:
                     agreements.append({
-                        'source': source_data.get('source', 'unknown'),
-                        'distance_km': distance,
-                        'confidence': source_data.get('confidence', 0.8)
+                        'source': source.get('source', 'unknown'),
+                        'distance_km': d_km,
+                        'confidence': confidence
                     })
                 else:
                     discrepancies.append({
-                        'source': source_data.get('source', 'unknown'),
-                        'distance_km': distance,
+                        'source': source.get('source', 'unknown'),
+                        'distance_km': d_km,
                         'predicted_coords': predicted_coords,
-                        'source_coords': source_coords
+                        'source_coords': (source.get('latitude', 0), source.get('longitude', 0))
                     })
-            except:
-                continue
+            agree_score = confidence if agreements else 0.0
+        else:
+            # Bucket every external source in one vectorized pass by comparing the
+            # haversine term against the edge of the near-threshold band
+            valid = _valid_coords(lats, lons)
+            hav = np.full(count, np.inf)
+            hav[valid] = _haversine_term(lat, lon, lats[valid], lons[valid])
+            
+            # Sources clearly inside 1 km on the sphere are inside it on the ellipsoid too;
+            # under 1 km arcsin(x) == x to ~1e-10, so their distances skip the arcsin
+            agree_idx = np.flatnonzero(hav < _AGREEMENT_HAV_LOW)
+            agree_km = 2 * EARTH_RADIUS_KM * np.sqrt(hav[agree_idx])
+            
+            # Everything else gets the reported geodesic distance and is bucketed on it,
+            # so sources in the near-threshold band can land on either side
+            disc_idx = np.flatnonzero(valid & (hav >= _AGREEMENT_HAV_LOW))
+            disc_km = np.empty(0)
+            if disc_idx.size:
+                disc_km = self._discrepancy_km(lat, lon, lats[disc_idx], lons[disc_idx])
+                near = disc_km < 1.0
+                if near.any():
+                    agree_idx = np.concatenate((agree_idx, disc_idx[near]))
+                    agree_km = np.concatenate((agree_km, disc_km[near]))
+                    order = np.argsort(agree_idx, kind='stable')
+                    agree_idx, agree_km = agree_idx[order], agree_km[order]
+                    disc_idx, disc_km = disc_idx[~near], disc_km[~near]
+            
+            # Materialize the result dicts once per bucket
+            agreements = [{
+                'source': external_data[i].get('source', 'unknown'),
+                'distance_km': distance,
+                'confidence': confidence
+            } for i, distance, confidence in zip(agree_idx.tolist(), agree_km.tolist(), confs[agree_idx].tolist())]
+            discrepancies = [{
+                'source': external_data[i].get('source', 'unknown'),
+                'distance_km': distance,
+                'predicted_coords': predicted_coords,
+                'source_coords': (external_data[i].get('latitude', 0), external_data[i].get('longitude', 0))
+            } for i, distance in zip(disc_idx.tolist(), disc_km.tolist())]
+            agree_score = float(confs[agree_idx].mean()) if agree_idx.size else 0.0
         
         # Calculate cross-validation score based on agreements
-        if agreements:
-            avg_confidence = sum(a['confidence'] for a in agreements) / len(agreements)
-            validation_result['cross_validation_score'] = min(avg_confidence, 1.0)
-        else:
-            validation_result['cross_validation_score'] = 0.0
+        validation_result['cross_validation_score'] = min(agree_score, 1.0)
         
         validation_result['external_agreement'] = agreements
         validation_result['discrepancies'] = discrepancies
         
         # Adjust final confidence based on cross-validation
-        base_confidence = prediction.get('predicted_location', {}).get('confidence', 0.5)
         cv_score = validation_result['cross_validation_score']
         
         # Weighted combination of original and cross-validation confidence
-        final_confidence = 0.7 * base_confidence + 0.3 * cv_score
+        final_confidence = self._w_cv_base * base_confidence + self._w_cv_scale * cv_score
         validation_result['final_confidence'] = min(final_confidence, 1.0)
         
         return validation_result
\ No newline at end of file